@@ -1,4 +1,5 @@
 import json
+import asyncio
 from fastapi import HTTPException
 import requests
 from typing import TypedDict, List, Dict, Optional
@@ -68,9 +69,11 @@ async def upload_files(files):
     try:
         all_documents = []
         for file in files:
-            file_data = await file.read()
+            # Hand over the spooled upload so extraction reads it from disk; passing bytes
+            # would copy the whole PDF to every extraction worker process
+            await file.seek(0)
             
-            docs = process_pdf_to_context(file_data, file.filename)
+            docs = await asyncio.to_thread(process_pdf_to_context, file.file, file.filename)
             all_documents.extend(docs)
 
             Chroma.from_documents(
@@ -38,6 +38,12 @@ DEFAULT_OLLAMA_CONFIG: OllamaConfig = {
 
 CHUNK_SIZE_LIMIT = 12000
 
+# Compiled once at import so tag counting never pays for pattern compilation
+# Regex translation:
+# JS: /\[REDACTED_[A-Z]+(?:_[0-9]+)?]/g
+# Python: r"\[REDACTED_[A-Z]+(?:_[0-9]+)?\]"
+REDACTED_TAG_RE = re.compile(r"\[REDACTED_[A-Z]+(?:_[0-9]+)?\]")
+
 # --- Helper Functions ---
 
 def generate_sanitize_prompt(context: str, jurisdiction: JurisdictionConfig) -> str:
@@ -223,9 +229,4 @@ def count_redactions(text: str) -> int:
     """
     Estimates PII count based on redacted tags.
     """
-    # Regex translation:
-    # JS: /\[REDACTED_[A-Z]+(?:_[0-9]+)?]/g
-    # Python: r"\[REDACTED_[A-Z]+(?:_[0-9]+)?\]"
-    pattern = r"\[REDACTED_[A-Z]+(?:_[0-9]+)?\]"
-    matches = re.findall(pattern, text)
-    return len(matches)
+    return len(REDACTED_TAG_RE.findall(text))
@@ -0,0 +1,25 @@
+from typing import Union
+
+# Kept free of the langchain imports in pdfUtils: extraction worker processes import this
+# module to unpickle extract_page_range, and should only pay for MuPDF.
+
+# A PDF path on disk, or the raw PDF bytes
+PdfSource = Union[bytes, str]
+
+def open_pdf(source: PdfSource):
+    """Opens a PDF from a filesystem path or from in-memory bytes."""
+    # Imported lazily so workers that never touch PDFs skip loading MuPDF
+    import pymupdf
+
+    if isinstance(source, str):
+        return pymupdf.open(source)
+    return pymupdf.open(stream=source, filetype="pdf")
+
+def extract_page_range(source: PdfSource, start: int, stop: int) -> list:
+    """Extracts text for pages [start, stop) from its own document handle."""
+    # MuPDF documents cannot be shared between threads, so every worker opens its own copy
+    doc = open_pdf(source)
+    try:
+        return [doc[i].get_text("text") or "" for i in range(start, stop)]
+    finally:
+        doc.close()
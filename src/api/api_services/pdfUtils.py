@@ -1,9 +1,17 @@
-import io
-from pypdf import PdfReader
-from fpdf import FPDF
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+from typing import IO, Optional, Union
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
 from langchain_chroma import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from src.api.api_services.pdfPages import PdfSource, extract_page_range, open_pdf
 
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000, 
@@ -11,36 +19,147 @@ text_splitter = RecursiveCharacterTextSplitter(
     separators=["\n\n", "\n", " ", "", "Chapter", "Section"]
 )
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+# Documents below this page count are extracted inline; spinning up workers costs more than it saves
+PARALLEL_PAGE_THRESHOLD = 32
+MAX_EXTRACTION_WORKERS = min(os.cpu_count() or 1, 8)
+# poppler's pdftotext is the fastest extractor available; used opportunistically when installed
+PDFTOTEXT_PATH = shutil.which("pdftotext")
+# Malformed PDFs can hang pdftotext; past this the PyMuPDF path takes over
+PDFTOTEXT_TIMEOUT_SECONDS = 60
+STREAM_COPY_CHUNK_SIZE = 1 << 20
+
+# One process pool shared by every extraction, so concurrent requests cannot multiply workers
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+def _get_extraction_pool() -> ProcessPoolExecutor:
+    """Returns the shared extraction pool, creating it on first use."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            # Extraction runs in worker threads, and forking a multi-threaded server can
+            # deadlock the children on locks held by other threads; forkserver avoids that.
+            # Platforms without forkserver (Windows) already default to spawn.
+            start_method = "forkserver" if "forkserver" in get_all_start_methods() else None
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=MAX_EXTRACTION_WORKERS,
+                mp_context=get_context(start_method),
+            )
+        return _extraction_pool
+
+def _discard_extraction_pool(pool: ProcessPoolExecutor) -> None:
+    """Drops a broken pool so the next extraction starts a fresh one."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        # Another thread may already have replaced it
+        if _extraction_pool is pool:
+            _extraction_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_extraction_pool() -> None:
+    """Stops the shared extraction pool's worker processes, if it was started."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(cancel_futures=True)
+            _extraction_pool = None
+
+def _extract_with_pdftotext(source: PdfSource) -> list:
+    """Extracts per-page text with poppler's pdftotext binary."""
+    # pdftotext reads a path directly, or the PDF bytes from stdin when given "-"
+    if isinstance(source, str):
+        args, stdin = [PDFTOTEXT_PATH, "-enc", "UTF-8", source, "-"], None
+    else:
+        args, stdin = [PDFTOTEXT_PATH, "-enc", "UTF-8", "-", "-"], source
+    proc = subprocess.run(args, input=stdin, capture_output=True, check=True, timeout=PDFTOTEXT_TIMEOUT_SECONDS)
+    # pdftotext terminates every page with a form feed, leaving an empty trailing element
+    pages = proc.stdout.decode("utf-8", "replace").split("\x0c")
+    if pages and pages[-1] == "":
+        pages.pop()
+    return pages
+
+def _extract_with_pymupdf(source: PdfSource) -> list:
+    """Extracts per-page text with PyMuPDF, in parallel for large documents."""
+    # PyMuPDF parses the document in its C core, much faster than pure-Python readers.
+    # The document is opened once here and stays open for the whole extraction.
+    doc = open_pdf(source)
+    try:
+        num_pages = len(doc)
+        if num_pages < PARALLEL_PAGE_THRESHOLD or MAX_EXTRACTION_WORKERS < 2:
+            return [page.get_text("text") or "" for page in doc]
+
+        # MuPDF holds the GIL while laying out text, so large documents are split
+        # into contiguous page ranges and extracted in separate processes
+        step = -(-num_pages // MAX_EXTRACTION_WORKERS)
+        ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        first_stop = ranges[0][1]
+        worker_ranges = ranges[1:]
+        first_texts = None
+        for attempt in range(2):
+            pool = _get_extraction_pool()
+            try:
+                # map() yields in submission order, so pages stay in document order
+                chunks = pool.map(
+                    extract_page_range,
+                    [source] * len(worker_ranges),
+                    [start for start, _ in worker_ranges],
+                    [stop for _, stop in worker_ranges],
+                )
+                if first_texts is None:
+                    # The first range is read from the already-open document while the workers
+                    # run, instead of paying for one more parse in a separate process
+                    first_texts = [doc[i].get_text("text") or "" for i in range(first_stop)]
+                page_texts = list(first_texts)
+                for chunk in chunks:
+                    page_texts.extend(chunk)
+                return page_texts
+            except BrokenProcessPool as e:
+                # A worker died (MuPDF crash, OOM kill); a broken pool never recovers, so
+                # replace it and retry once. A PDF that kills workers twice is reported.
+                _discard_extraction_pool(pool)
+                if attempt:
+                    raise
+                print(f"PDF extraction worker died, retrying on a fresh pool: {e}")
+    finally:
+        doc.close()
+
+def extract_text_from_pdf(file: Union[bytes, str, IO[bytes]]) -> str:
     """
-    Extracts text from a PDF file stream.
+    Extracts text from a PDF given as bytes, a file path or a binary stream.
     """
+    spooled_path = None
     try:
-        # Load the document from bytes (equivalent to arrayBuffer)
-        # pypdf can read directly from a BytesIO stream
-        pdf_stream = io.BytesIO(file_bytes)
-        reader = PdfReader(pdf_stream)
-        
-        full_text = []
-        num_pages = len(reader.pages)
-
-        # Iterate through pages (Python is 0-indexed, unlike PDF definition)
-        for i in range(num_pages):
-            page = reader.pages[i]
-            
-            # extract_text() is the equivalent of getting text items and joining them
-            # pypdf handles the layout extraction automatically
-            page_text = page.extract_text() or ""
-            
-            # Mimicking the output format of the TS function
-            full_text.append(f"--- Page {i + 1} ---\n{page_text}\n\n")
-
-        return "".join(full_text)
+        source = file
+        if not isinstance(file, (bytes, str)):
+            # Copy streams to disk in chunks so large uploads are never held in memory whole
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+                # Recorded before copying so a partial copy is still removed below
+                spooled_path = source = tmp.name
+                shutil.copyfileobj(file, tmp, length=STREAM_COPY_CHUNK_SIZE)
+
+        page_texts = None
+        if PDFTOTEXT_PATH:
+            try:
+                page_texts = _extract_with_pdftotext(source)
+            except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                print(f"pdftotext failed, falling back to PyMuPDF: {e}")
+
+        if page_texts is None:
+            page_texts = _extract_with_pymupdf(source)
+
+        # Mimicking the output format of the TS function (pages are 1-indexed)
+        return "".join(
+            f"--- Page {i + 1} ---\n{page_text}\n\n" for i, page_text in enumerate(page_texts)
+        )
 
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         # Mimicking the fallback error throw
-        raise ValueError("Failed to extract text from PDF file. Please try a text or JSON file if this persists.")
+        raise ValueError("Failed to extract text from PDF file. Please try a text or JSON file if this persists.") from e
+
+    finally:
+        if spooled_path:
+            os.remove(spooled_path)
     
 def create_context(documents):
     """Chunks text and adds metadata headers for context."""
@@ -54,9 +173,9 @@ def create_context(documents):
         ])
     return chunks
 
-def process_pdf_to_context(pdf_bytes: bytes, file_title: str):
+def process_pdf_to_context(pdf_file: Union[bytes, str, IO[bytes]], file_title: str):
     
-    raw_text = extract_text_from_pdf(pdf_bytes)
+    raw_text = extract_text_from_pdf(pdf_file)
     doc_chunks = text_splitter.split_text(raw_text)
     
     return [
@@ -70,10 +189,16 @@ def generate_redacted_pdf(content: str) -> bytes:
     """
     Generates a PDF with the given text content.
     """
+    from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
+
     # Setup PDF (A4 is default in FPDF)
     # unit='mm' is default
     pdf = FPDF(orientation="P", unit="mm", format="A4")
     
+    # We set strict margins to match the JS 'margin = 15' logic
+    pdf.set_margins(left=15, top=15, right=15)
+
     # Add a page (required before writing)
     pdf.add_page()
     
@@ -82,14 +207,15 @@ def generate_redacted_pdf(content: str) -> bytes:
     
     # Formatting constants
     line_height = 5
-    # FPDF handles margins automatically via set_margins or simply by x/y positioning.
-    # We set strict margins to match the JS 'margin = 15' logic
-    pdf.set_margins(left=15, top=15, right=15)
-    
-    # In jsPDF, you manually calculated page breaks and split text.
-    # In FPDF, 'multi_cell' handles text wrapping and auto-pagination automatically.
-    # w=0 means "width of the page starting from current margin"
-    pdf.multi_cell(w=0, h=line_height, txt=content)
+
+    # multi_cell measures the text character by character in Python, which dominates
+    # generation for long documents. Courier is monospaced, so the number of columns
+    # per line is fixed and lines can be wrapped up front with textwrap instead.
+    columns = max(int(pdf.epw // pdf.get_string_width("M")), 1)
+    for paragraph in content.splitlines():
+        # Blank lines wrap to an empty list but must still advance the cursor
+        for line in textwrap.wrap(paragraph, columns) or [""]:
+            pdf.cell(w=0, h=line_height, text=line, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     
     # Return bytes (equivalent to Blob)
     return bytes(pdf.output())
@@ -1,15 +1,22 @@
-import io
+import asyncio
 from pydantic import BaseModel
 from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from fastapi_mcp import FastApiMCP
-from typing import Annotated, List
-from src.api.api_services.geminiService import generate_summary
-from src.api.api_services.pdfUtils import extract_text_from_pdf
+from typing import Annotated, List, Literal
+from contextlib import asynccontextmanager
+from src.api.api_services.geminiService import generate_summary, perform_privacy_validation, submit_privacy_validation_batch, fetch_privacy_validation_batch
+from src.api.api_services.pdfUtils import extract_text_from_pdf, shutdown_extraction_pool
 from src.api.api_services.ollamaService import check_ollama_connection, sanitize_with_ollama, assess_risk_with_ollama,DEFAULT_OLLAMA_CONFIG
 from src.api.api_services.ollamaRAGServices import screen_privacy_risks, upload_files
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop the PDF extraction worker processes with the server
+    shutdown_extraction_pool()
+
+app = FastAPI(lifespan=lifespan)
 router = APIRouter()
 
 class Config(BaseModel):
@@ -19,6 +26,19 @@ class Config(BaseModel):
 class response(BaseModel):
     data: str
     
+def attachment_response(content: str, filename: str) -> Response:
+    """Wraps content in the response model and returns it as a downloadable file."""
+    # Dump Pydantic model to a JSON string, then to bytes
+    json_data = response(data=content).model_dump_json().encode()
+
+    # The body is already fully in memory, so a plain Response avoids StreamingResponse's
+    # chunked iteration and lets Starlette send an exact Content-Length
+    return Response(
+        content=json_data,
+        media_type="text/plain",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @app.get("/")
 async def root():
     return {"message": "Redact API is running"}
@@ -35,20 +55,30 @@ async def upload_pdf(file: Annotated[UploadFile, File(description="Upload a PDF"
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
-    # Process file content
-    content = extract_text_from_pdf(await file.read())
-    # Create data using Pydantic
-    config = response(data=content)
-    
-    # Dump Pydantic model to a JSON string, then to bytes
-    json_data = config.model_dump_json()
-    stream = io.BytesIO((json_data).encode())
-    
-    return StreamingResponse(
-        stream, 
-        media_type="text/plain", 
-        headers={"Content-Disposition": "attachment; filename=pdf_data.txt"}
-    )
+    # Process file content straight from the spooled upload instead of reading it into memory.
+    # Extraction is CPU-bound, so it runs in a worker thread to keep the event loop responsive.
+    await file.seek(0)
+    content = await asyncio.to_thread(extract_text_from_pdf, file.file)
+    return attachment_response(content, "pdf_data.txt")
+
+@app.post("/upload/pdf/batch", operation_id="summarize_pdf_batch")
+async def upload_pdf_batch(files: List[UploadFile] = File(...)):
+    # Validate file type manually if needed
+    for file in files:
+        if file.content_type != "application/pdf":
+            raise HTTPException(status_code=400, detail="File must be PDFs")
+
+    async def summarize(file: UploadFile) -> dict:
+        # Gemini concurrency is capped inside generate_summary by GEMINI_NUM_PARALLEL
+        try:
+            await file.seek(0)
+            text = await asyncio.to_thread(extract_text_from_pdf, file.file)
+            return {"filename": file.filename, "summary": await generate_summary(text)}
+        except Exception as e:
+            # One bad file must not discard the summaries of the others
+            return {"filename": file.filename, "error": str(e)}
+
+    return await asyncio.gather(*(summarize(file) for file in files))
 
 @app.post("/upload/multi_files_screen", operation_id="upload_multiple_files_screen")
 async def upload_multiple_files(files: List[UploadFile] = File(...)):
@@ -71,19 +101,36 @@ async def create_summary(file: Annotated[UploadFile, File(description="Upload a
         raise HTTPException(status_code=400, detail="File must be a plain text file")
     
     # Process file content
-    content = generate_summary(await file.read())
-    # Create data using Pydantic
-    config = response(data=content)
-    
-    # Dump Pydantic model to a JSON string, then to bytes
-    json_data = config.model_dump_json()
-    stream = io.BytesIO((json_data).encode())
-    
-    return StreamingResponse(
-        stream, 
-        media_type="text/plain", 
-        headers={"Content-Disposition": "attachment; filename=summary.txt"}
-    )
+    content = await generate_summary(await file.read())
+    return attachment_response(content, "summary.txt")
+
+@app.post("/validate", operation_id="validate_sanitization")
+async def validate_sanitization(
+    originals: List[UploadFile] = File(...),
+    sanitized: List[UploadFile] = File(...),
+    mode: Literal["sync", "batch"] = "sync",
+):
+    # Files are paired by position: originals[i] is audited against sanitized[i]
+    if len(originals) != len(sanitized):
+        raise HTTPException(status_code=400, detail="Each original file needs a matching sanitized file")
+    for file in [*originals, *sanitized]:
+        if file.content_type != "text/plain":
+            raise HTTPException(status_code=400, detail="Files must be plain text files")
+
+    # Raw bytes are passed through; the audit only decodes the parts that fit in the prompt
+    pairs = [(await original.read(), await redacted.read()) for original, redacted in zip(originals, sanitized)]
+
+    # Batch mode is cheaper but can take hours, so it returns the job name straight away;
+    # results are collected from /validate/batch/{job_name}. Keep sync for interactive use.
+    if mode == "batch":
+        return {"job_name": await submit_privacy_validation_batch(pairs)}
+    return await asyncio.gather(*(perform_privacy_validation(original, redacted) for original, redacted in pairs))
+
+@app.get("/validate/batch/{job_name:path}", operation_id="get_validation_batch")
+async def get_validation_batch(job_name: str):
+    # results stays null until the job has succeeded
+    state, results = await fetch_privacy_validation_batch(job_name)
+    return {"job_name": job_name, "state": state, "results": results}
 
 @app.post("/sanitize")
 async def sanitize(file: Annotated[UploadFile, File(description="Upload a text file")]):
@@ -93,18 +140,7 @@ async def sanitize(file: Annotated[UploadFile, File(description="Upload a text f
     sanitized = sanitize_with_ollama(text_file, DEFAULT_OLLAMA_CONFIG, "General Text", {"name": "Global", "law": "General Privacy"})
              
     content = sanitized["sanitizedText"]
-    # Create data using Pydantic
-    config = response(data=content)
-    
-    # Dump Pydantic model to a JSON string, then to bytes
-    json_data = config.model_dump_json()
-    stream = io.BytesIO((json_data).encode())
-    
-    return StreamingResponse(
-        stream, 
-        media_type="text/plain", 
-        headers={"Content-Disposition": "attachment; filename=sanitized.txt"}
-    )
+    return attachment_response(content, "sanitized.txt")
 
 @app.get("/download/risk-report")
 async def download_risk_report(uploaded_file: Annotated[UploadFile, File(description="Upload a text file")]):
@@ -113,18 +149,7 @@ async def download_risk_report(uploaded_file: Annotated[UploadFile, File(descrip
     
     # Process file content
     content = assess_risk_with_ollama(await uploaded_file.read(), DEFAULT_OLLAMA_CONFIG, {"name": "Global", "law": "General Privacy"})
-    # Create data using Pydantic
-    config = response(data=content)
-    
-    # Dump Pydantic model to a JSON string, then to bytes
-    json_data = config.model_dump_json()
-    stream = io.BytesIO((json_data).encode())
-    
-    return StreamingResponse(
-        stream, 
-        media_type="text/plain", 
-        headers={"Content-Disposition": "attachment; filename=risk_report.txt"}
-    )
+    return attachment_response(content, "risk_report.txt")
 
 @app.get("/download/screen_docs")
 async def download_screening_report():